@@ -6,10 +6,12 @@
 import subprocess
 import sys
 import os
-from datetime import date
+from datetime import date, timedelta
 from pathlib import Path
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
 import plotly.express as px
 
@@ -33,19 +35,54 @@ def get_supabase():
 
 def get_last_scrape_date() -> date | None:
     """讀取 Supabase 中最新一筆的爬取日期。"""
-    sb = get_supabase()
-    if sb is None:
+    if SB is None:
         return None
     try:
-        res = sb.table("course_scrapes").select("scraped_at").order("scraped_at", desc=True).limit(1).execute()
+        res = SB.table("course_scrapes").select("scraped_at").order("scraped_at", desc=True).limit(1).execute()
         if not res.data:
             return None
         return pd.to_datetime(res.data[0]["scraped_at"]).date()
     except Exception:
         return None
 
+def delete_scrapes(ids: list[int]) -> None:
+    """依 id 分批刪除，避免 in_() 清單過長超過 PostgREST 的 URL 長度限制。"""
+    for i in range(0, len(ids), DELETE_CHUNK):
+        SB.table("course_scrapes").delete().in_("id", ids[i:i + DELETE_CHUNK]).execute()
+
+@st.cache_data(ttl=120, show_spinner=False)
+def cleanup_counts() -> tuple[int, int]:
+    """批次清除的候選筆數（服務頁、學生數空值）；HEAD + count，不傳任何資料列。"""
+    svc = (SB.table("course_scrapes").select("id", count="exact", head=True)
+             .like("course_url", "%/services/%").execute())
+    null = (SB.table("course_scrapes").select("id", count="exact", head=True)
+              .is_("students", "null").execute())
+    return svc.count or 0, null.count or 0
+
 PLATFORM_LABEL = {"hahow": "Hahow", "pressplay": "PressPlay"}
 PLATFORM_COLOR = {"hahow": "#FF6B35", "pressplay": "#3A86FF"}
+# 儀表板實際用到的欄位與型別（不用 select("*")，少傳不需要的欄位）；
+# scraped_at 先以字串讀入，再由 pd.to_datetime 解析時區
+SCRAPE_SCHEMA = pa.schema([
+    ("id",          pa.int64()),
+    ("platform",    pa.string()),
+    ("course_name", pa.string()),
+    ("teacher",     pa.string()),
+    ("students",    pa.int64()),
+    ("price",       pa.float32()),
+    ("rank",        pa.int32()),
+    ("scraped_at",  pa.string()),
+    ("course_url",  pa.string()),
+])
+SCRAPE_COLUMNS = ",".join(SCRAPE_SCHEMA.names)
+# 整數欄轉 pandas 可為空的整數型別（缺值不會被升成 float64）；price 維持 float32
+ARROW_TO_PANDAS = {pa.int64(): pd.Int64Dtype(), pa.int32(): pd.Int32Dtype()}
+PAGE_SIZE = 1000            # 與 Supabase 預設 max rows 一致
+HISTORY_DAYS_OPTIONS = [90, 180, 365, 0]   # 0 表示全部；一般使用者固定讀最近 90 天
+DELETE_CHUNK = 500
+TREND_MAX_DAILY_POINTS = 90  # 趨勢圖超過這麼多天就改成每週一點
+SCRAPE_LOG_FILE = Path(__file__).parent / "data" / "scrape_job.log"   # 背景爬蟲的輸出
+SCRAPE_POLL_SECONDS = 5
 
 # ── 頁面設定 ──────────────────────────────────────────────────────────────────
 
@@ -55,6 +92,9 @@ st.set_page_config(
     layout="wide",
 )
 
+# 每次 rerun 只取一次 client；cache_resource 讓同一個 client（含其 HTTP 連線池）跨 rerun 共用
+SB = get_supabase()
+
 st.title("📈 課程趨勢儀表板")
 st.caption("追蹤 Hahow & PressPlay 熱門課程的成長率與成長速度")
 
@@ -89,7 +129,8 @@ with st.sidebar:
 
         st.divider()
 
-        def run_scraper(extra_args: list, spinner_msg: str):
+        def run_scraper(extra_args: list, status_msg: str):
+            """在背景啟動 scraper（不阻塞 Streamlit），輸出寫進 log 檔，由下方的 fragment 輪詢狀態。"""
             # 明確把 Streamlit Secrets 注入 subprocess 環境
             # （Streamlit Cloud 的 secrets 不一定自動出現在子 process 的 os.getenv）
             env = os.environ.copy()
@@ -98,71 +139,157 @@ with st.sidebar:
                     env[key] = st.secrets[key]
                 except (KeyError, Exception):
                     pass
-            with st.spinner(spinner_msg):
-                proc = subprocess.run(
-                    [python_exec, str(scraper_path)] + extra_args,
-                    capture_output=True,
-                    text=True,
+            SCRAPE_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+            with open(SCRAPE_LOG_FILE, "w", encoding="utf-8") as log_file:
+                proc = subprocess.Popen(
+                    [python_exec, "-u", str(scraper_path)] + extra_args,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
                     cwd=str(project_dir),
                     env=env,
+                    start_new_session=True,   # 與 Streamlit 脫鉤，頁面重整也不會被中斷
                 )
-            if proc.returncode == 0:
-                # 先把 log 存進 session_state，rerun 後再顯示
-                st.session_state["last_scrape_log"] = proc.stdout
+            # 保留 Popen 物件：poll() 會回收結束的子 process，不會把 zombie 誤判成仍在執行
+            st.session_state["scrape_job"] = {"proc": proc, "msg": status_msg}
+            st.session_state.pop("last_scrape_log", None)
+            st.session_state.pop("last_scrape_error", None)
+
+        def read_log_tail(n_bytes: int) -> str:
+            """讀 log 檔最後 n_bytes（不把整個檔案讀進來）。"""
+            try:
+                with open(SCRAPE_LOG_FILE, "rb") as f:
+                    f.seek(0, os.SEEK_END)
+                    f.seek(max(f.tell() - n_bytes, 0))
+                    return f.read().decode("utf-8", errors="replace")
+            except FileNotFoundError:
+                return ""
+
+        @st.fragment(run_every=SCRAPE_POLL_SECONDS)
+        def scrape_job_status():
+            """只重跑這個區塊來輪詢背景爬蟲；結束後才整頁 rerun 載入新資料。"""
+            job = st.session_state.get("scrape_job")
+            if job is None:
+                return
+            returncode = job["proc"].poll()
+            if returncode is None:
+                st.info(f"⏳ {job['msg']}")
+                with st.expander("即時 log", expanded=False):
+                    st.text(read_log_tail(1200))
+                return
+            # 先把 log 存進 session_state，rerun 後再顯示
+            del st.session_state["scrape_job"]
+            if returncode == 0:
+                st.session_state["last_scrape_log"] = read_log_tail(2000)
                 st.cache_data.clear()
-                st.rerun()
             else:
-                st.error("爬取失敗")
-                if proc.stdout:
-                    st.text("--- stdout ---\n" + (proc.stdout[-1200:] if len(proc.stdout) > 1200 else proc.stdout))
-                if proc.stderr:
-                    st.text("--- stderr ---\n" + (proc.stderr[-800:] if len(proc.stderr) > 800 else proc.stderr))
+                st.session_state["last_scrape_error"] = read_log_tail(2000)
+            st.rerun()
 
         last_scrape = get_last_scrape_date()
         if last_scrape:
             st.caption(f"上次更新：{last_scrape}")
 
+        job_running = "scrape_job" in st.session_state
         run_update   = st.button("🔄 更新學生數",   width="stretch", type="primary",
+                                 disabled=job_running,
                                  help="只更新學生人數，markdown 模式（~20 credits）")
         run_discover = st.button("🔍 重新發現課程", width="stretch",
+                                 disabled=job_running,
                                  help="重新爬列表頁取得最新排名，LLM 模式（~60 credits）")
         if run_update:
-            run_scraper([], "更新學生數中（約 8～12 分鐘）…")
+            # 手動更新要拿到當下的數字，不讀 scraper 的回應快取
+            run_scraper(["--no-cache"], "更新學生數中（約 8～12 分鐘）…")
+            st.rerun()
         if run_discover:
-            run_scraper(["--discover"], "重新發現課程中（約 3～5 分鐘）…")
+            run_scraper(["--discover", "--no-cache"], "重新發現課程中（約 3～5 分鐘）…")
+            st.rerun()
+        scrape_job_status()
+
+        st.selectbox(
+            "載入資料範圍",
+            options=HISTORY_DAYS_OPTIONS,
+            format_func=lambda d: f"最近 {d} 天" if d else "全部",
+            key="history_days",
+            help="一般訪客固定讀最近 90 天；管理員可放寬以檢視完整歷史",
+        )
 
         # 顯示上次爬取的 log（rerun 後持續顯示，直到下次爬取）
         if "last_scrape_log" in st.session_state:
-            log = st.session_state["last_scrape_log"]
             st.success("上次爬取完成")
             with st.expander("查看 log", expanded=False):
-                st.text(log[-2000:] if len(log) > 2000 else log)
+                st.text(st.session_state["last_scrape_log"])
+        if "last_scrape_error" in st.session_state:
+            st.error("爬取失敗")
+            st.text(st.session_state["last_scrape_error"])
 
     st.divider()
 
 # ── 載入資料 ──────────────────────────────────────────────────────────────────
 
+def rows_to_frame(rows: list[dict]) -> pd.DataFrame:
+    """
+    先走 Arrow：推斷型別後依 SCRAPE_SCHEMA 安全轉型（在 C 裡完成；小數學生數、int 溢位、
+    無法解析的字串都會報錯，不會被默默截斷）。有任何一筆格式不對就退回逐欄
+    to_numeric(errors="coerce")，壞掉的值變成 NaN，不讓整個儀表板失敗。
+    """
+    try:
+        table = pa.Table.from_pylist(rows).select(SCRAPE_SCHEMA.names).cast(SCRAPE_SCHEMA)
+        return table.to_pandas(types_mapper=ARROW_TO_PANDAS.get)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, KeyError):
+        df = pd.DataFrame(rows, columns=SCRAPE_SCHEMA.names)
+        for col in ("students", "price", "rank"):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+        return df
+
 @st.cache_data(ttl=120)
-def load_data() -> pd.DataFrame:
-    sb = get_supabase()
-    if sb is None:
+def load_data(since: date | None = None) -> pd.DataFrame:
+    """
+    讀取 since 之後的爬取紀錄（None 表示全部）。
+    - 日期篩選交給 PostgREST（建議在 scraped_at 上建 index）
+    - Supabase 每次回應有筆數上限（預設 1000，可能被設得更小），因此分頁讀到回傳空頁為止
+    """
+    if SB is None:
         st.error("尚未設定 Supabase 連線，請在 Secrets 中加入 SUPABASE_URL 和 SUPABASE_KEY。")
         return pd.DataFrame()
     try:
-        res = sb.table("course_scrapes").select("*").order("scraped_at").execute()
-        if not res.data:
+        rows: list[dict] = []
+        while True:
+            # postgrest 的 query builder 不能重複 .range()，每頁重新組 query
+            query = SB.table("course_scrapes").select(SCRAPE_COLUMNS)
+            if since is not None:
+                query = query.gte("scraped_at", since.isoformat())
+            # scraped_at 同一次爬取全部相同，加上 id 當唯一的次要排序，分頁邊界才不會重複或漏列
+            res = query.order("scraped_at").order("id").range(len(rows), len(rows) + PAGE_SIZE - 1).execute()
+            # 不能以「本頁不滿 PAGE_SIZE」判斷結束：max-rows 比 PAGE_SIZE 小時每頁都不滿；
+            # 下一頁從實際讀到的筆數接著讀，直到回傳空頁
+            if not res.data:
+                break
+            rows.extend(res.data)
+        if not rows:
             return pd.DataFrame()
-        df = pd.DataFrame(res.data)
-        df["scraped_at"] = pd.to_datetime(df["scraped_at"])
-        df["students"]   = pd.to_numeric(df["students"], errors="coerce")
-        df["price"]      = pd.to_numeric(df["price"],    errors="coerce")
-        df["rank"]       = pd.to_numeric(df["rank"],     errors="coerce")
+        df = rows_to_frame(rows)
+        df["scraped_at"] = pd.to_datetime(df["scraped_at"], format="ISO8601")
+        # 日期欄只算一次；保持 datetime64（非 object 的 date），比較與 groupby 都走 C 路徑
+        df["date"]       = df["scraped_at"].dt.tz_localize(None).dt.normalize()
+        # 低基數字串欄轉 category：groupby / 篩選改用整數 code，不必逐一 hash 字串
+        for col in ("platform", "course_name", "teacher"):
+            df[col] = df[col].astype("category")
+        # 資料指紋：只在 cache miss 時算一次，供下游 st.cache_data 當 key
+        df.attrs["fingerprint"] = int(
+            pd.util.hash_pandas_object(
+                df[["platform", "course_name", "scraped_at", "students"]], index=False
+            ).sum()
+        )
         return df
     except Exception as e:
         st.error(f"資料庫讀取失敗：{e}")
         return pd.DataFrame()
 
-df = load_data()
+history_days = st.session_state.get("history_days", HISTORY_DAYS_OPTIONS[0])
+if not st.session_state.get("is_admin"):
+    history_days = HISTORY_DAYS_OPTIONS[0]
+# 含今天共 history_days 天（since 那天也會讀進來，所以往前推 history_days - 1 天）
+df = load_data(date.today() - timedelta(days=history_days - 1) if history_days else None)
 
 if df.empty:
     st.info("尚無資料，請點擊左側「🔄 立即爬取」按鈕開始收集課程資料。")
@@ -173,10 +300,11 @@ if df.empty:
 with st.sidebar:
     st.header("篩選條件")
 
-    platform_options = ["全部"] + [PLATFORM_LABEL[p] for p in sorted(df["platform"].unique())]
+    # category 的 categories 在轉型時已排序好，不必再掃整欄 unique() + sorted()
+    platform_options = ["全部"] + [PLATFORM_LABEL[p] for p in df["platform"].cat.categories]
     selected_label = st.selectbox("平台", platform_options)
 
-    all_dates = sorted(df["scraped_at"].dt.date.unique())
+    all_dates = df["date"].drop_duplicates().sort_values().dt.date.tolist()
     if len(all_dates) >= 2:
         date_range = st.date_input(
             "日期範圍",
@@ -196,80 +324,108 @@ with st.sidebar:
 
 # ── 套用篩選 ──────────────────────────────────────────────────────────────────
 
-df_f = df.copy()
+# 組成單一布林遮罩再取一次子集（下游只讀不寫，不必先 copy 整張表）
+mask = (df["date"] >= pd.Timestamp(start_date)) & (df["date"] <= pd.Timestamp(end_date))
 if selected_label != "全部":
     inv_map = {v: k for k, v in PLATFORM_LABEL.items()}
-    df_f = df_f[df_f["platform"] == inv_map[selected_label]]
-
-df_f = df_f[
-    (df_f["scraped_at"].dt.date >= start_date) &
-    (df_f["scraped_at"].dt.date <= end_date)
-]
+    mask &= df["platform"] == inv_map[selected_label]
+df_f = df.loc[mask]
 
 # ── 計算成長指標 ──────────────────────────────────────────────────────────────
 
-def compute_growth(df: pd.DataFrame) -> pd.DataFrame:
+def daily_aggregate(df: pd.DataFrame) -> pd.DataFrame:
+    """按日彙總：每門課每天取最後一筆（最新的爬取結果），避免同日多次爬取干擾。"""
+    return (
+        df.sort_values("scraped_at")
+          .groupby(["platform", "course_name", "date"], sort=False, observed=True)
+          .last()
+          .reset_index()
+    )
+
+def compute_growth(daily: pd.DataFrame) -> pd.DataFrame:
     """
-    以「天」為單位計算成長指標：
-    - 先將每門課按日期彙總（每天取最後一筆），避免同日多次爬取干擾
+    以「天」為單位計算成長指標（輸入為 daily_aggregate 的結果，全部以向量化運算完成）：
     - student_diff : 首日 → 末日的學生人數變化量
     - growth_rate  : 成長率 (%)
     - growth_speed : 每天成長人數 (人/天)，需至少跨越 2 個不同日期
     - days_elapsed : 觀察天數（日曆天數差）
     """
-    rows = []
-    for (platform, course_name), grp in df.groupby(["platform", "course_name"]):
-        grp = grp.sort_values("scraped_at")
-
-        # 按日彙總：每天取最後一筆（最新的爬取結果）
-        grp["_date"] = grp["scraped_at"].dt.date
-        daily = (
-            grp.groupby("_date", sort=True)
-               .last()
-               .reset_index()
-        )
-
-        first = daily.iloc[0]
-        last  = daily.iloc[-1]
-
-        s0 = first["students"]
-        s1 = last["students"]
-
-        # 日曆天數差（不是小時差）
-        day_diff = (last["_date"] - first["_date"]).days
-
-        diff  = (s1 - s0)           if pd.notna(s0) and pd.notna(s1) else None
-        rate  = (diff / s0 * 100)   if diff is not None and s0 and s0 > 0 else None
-        # 成長速度只在有跨日資料時才計算
-        speed = (diff / day_diff)   if diff is not None and day_diff >= 1 else None
-
-        rows.append({
-            "platform":        platform,
-            "course_name":     course_name,
-            "teacher":         last["teacher"],
-            "latest_students": s1,
-            "latest_price":    last["price"],
-            "latest_rank":     last["rank"] if "rank" in grp.columns else None,
-            "student_diff":    diff,
-            "growth_rate":     rate,
-            "growth_speed":    speed,
-            "days_elapsed":    day_diff if day_diff >= 1 else None,
-            "scrape_count":    len(daily),
-            "course_url":      last.get("course_url", "") or "",
-        })
-    return pd.DataFrame(rows)
-
-growth_df = compute_growth(df_f)
+    keys = ["platform", "course_name"]
+
+    # daily 依爬取時間先後出現（groupby sort=False 保留出現順序），同一門課的日期遞增，
+    # 首末列即首日與末日；不需要額外排序。
+    # 各課程交錯出現，首末兩表的列順序不同，last 要對齊 first 的順序，
+    # 否則下面 np.where 產生的陣列會按位置錯配
+    first = daily.drop_duplicates(keys, keep="first").set_index(keys)
+    last  = daily.drop_duplicates(keys, keep="last").set_index(keys).reindex(first.index)
+
+    # Int64 的 NA 不能直接進 np.where，運算前先轉成 float（NA → NaN）
+    s0 = first["students"].astype("float64")
+    s1 = last["students"].astype("float64")
+
+    # 日曆天數差（不是小時差）
+    day_diff = (last["date"] - first["date"]).dt.days
+
+    diff  = s1 - s0
+    rate  = np.where(s0 > 0, diff / s0 * 100, np.nan)
+    # 成長速度只在有跨日資料時才計算
+    speed = np.where(day_diff >= 1, diff / day_diff, np.nan)
+
+    return pd.DataFrame({
+        "teacher":         last["teacher"],
+        "latest_students": last["students"],
+        "latest_price":    last["price"],
+        "latest_rank":     last["rank"],
+        "student_diff":    diff,
+        "growth_rate":     rate,
+        "growth_speed":    speed,
+        "days_elapsed":    day_diff.where(day_diff >= 1),
+        "scrape_count":    daily.groupby(keys, observed=True, sort=False).size(),
+        "course_url":      last["course_url"].fillna(""),
+    }).reset_index()
+
+@st.cache_data(ttl=120, show_spinner=False)
+def cached_daily_growth(df_hash: int, platform: str | None, start: date, end: date,
+                        _df_f: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    以（資料指紋, 篩選條件）為 key 快取每日彙總與成長指標；_df_f 不參與 hash。
+    每日彙總同時供趨勢圖使用，不必再 groupby 一次。
+    """
+    daily = daily_aggregate(_df_f)
+    return daily, compute_growth(daily)
+
+def format_signed(values: pd.Series, fmt: str) -> pd.Series:
+    """正數前加「+」、缺值顯示「—」；以整欄運算取代逐列 lambda。"""
+    text = values.map(fmt.format, na_action="ignore").fillna("").astype(str)
+    sign = np.where(values > 0, "+", "")
+    return (sign + text).where(values.notna(), "—")
+
+daily_df, growth_df = cached_daily_growth(
+    df.attrs["fingerprint"],
+    None if selected_label == "全部" else selected_label,
+    start_date,
+    end_date,
+    df_f,
+)
 
 # ── 總覽指標 ──────────────────────────────────────────────────────────────────
 
-latest_time    = df["scraped_at"].max()
-unique_courses = df[["platform", "course_name"]].drop_duplicates().shape[0]
-scrape_count   = df["scraped_at"].nunique()
+@st.cache_data(ttl=120, show_spinner=False)
+def overview_metrics(df_hash: int, _df: pd.DataFrame) -> tuple[int, int, pd.Timestamp]:
+    """總覽指標只依原始資料而定（與側邊欄篩選無關），以資料指紋為 key 快取。"""
+    return (
+        _df[["platform", "course_name"]].drop_duplicates().shape[0],
+        _df["scraped_at"].nunique(),
+        _df["scraped_at"].max(),
+    )
+
+unique_courses, scrape_count, latest_time = overview_metrics(df.attrs["fingerprint"], df)
 
+# 指標只涵蓋已載入的範圍；載入全部時才是真正的累計
+window_label = f"（近 {history_days} 天）" if history_days else ""
 c1, c2, c3 = st.columns(3)
-c1.metric("追蹤課程總數", unique_courses)
-c2.metric("累計爬取次數", scrape_count)
+c1.metric(f"追蹤課程總數{window_label}", unique_courses)
+c2.metric(f"{'爬取次數' if history_days else '累計爬取次數'}{window_label}", scrape_count)
 c3.metric("最後更新時間", latest_time.strftime("%Y-%m-%d %H:%M"))
 
 st.divider()
@@ -288,30 +444,35 @@ fast = (
 )
 
 if fast.empty:
-    unique_days = df_f["scraped_at"].dt.date.nunique()
+    unique_days = df_f["date"].nunique()
     if unique_days < 2:
         st.info("需要至少 **兩天** 的資料才能計算成長率。")
     else:
         st.info(f"目前無課程成長率超過 {growth_threshold}%，可調整側邊欄的門檻值。")
 else:
-    for _, row in fast.iterrows():
-        plabel = PLATFORM_LABEL.get(row["platform"], row["platform"])
-        rate_str  = f"+{row['growth_rate']:.1f}%"
-        speed_str = f"+{row['growth_speed']:,.1f} 人/天" if pd.notna(row["growth_speed"]) else "—"
-        diff_str  = f"+{int(row['student_diff']):,} 人"
-
-        with st.container(border=True):
-            col1, col2, col3, col4 = st.columns([4, 1, 1, 1])
-            url = row.get("course_url", "") or ""
-            name_md = f"[{row['course_name']}]({url})" if url else row['course_name']
-            col1.markdown(
-                f"**{name_md}**  \n"
-                f"<span style='color:gray'>{row['teacher']} ｜ {plabel}</span>",
-                unsafe_allow_html=True,
-            )
-            col2.metric("目前學生", f"{int(row['latest_students']):,}" if pd.notna(row['latest_students']) else "N/A")
-            col3.metric("成長率",   rate_str,  delta=diff_str)
-            col4.metric("成長速度", speed_str)
+    # 一次送出整張表（不逐列建立 container / metric），格式交給前端處理
+    fast_display = pd.DataFrame({
+        "課程名稱": fast["course_name"],
+        "老師":     fast["teacher"],
+        "平台":     fast["platform"].map(PLATFORM_LABEL),
+        "目前學生": fast["latest_students"],
+        "新增學生": fast["student_diff"],
+        "成長率":   fast["growth_rate"],
+        "成長速度": fast["growth_speed"],
+        "連結":     fast["course_url"],
+    })
+    st.dataframe(
+        fast_display,
+        column_config={
+            "目前學生": st.column_config.NumberColumn("目前學生", format="localized"),
+            "新增學生": st.column_config.NumberColumn("新增學生", format="+%d 人"),
+            "成長率":   st.column_config.NumberColumn("成長率",   format="+%.1f%%"),
+            "成長速度": st.column_config.NumberColumn("成長速度", format="+%.1f 人/天"),
+            "連結":     st.column_config.LinkColumn("連結", display_text="🔗 開啟"),
+        },
+        width="stretch",
+        hide_index=True,
+    )
 
 st.divider()
 
@@ -319,23 +480,23 @@ st.divider()
 
 st.subheader("📋 最新課程排名")
 
-latest_snap = df_f[df_f["scraped_at"] == df_f["scraped_at"].max()].copy()
+# load_data 依 scraped_at 排序讀入、篩選不改變順序，最後一列即最新一次爬取，不必再掃一次 max()
+if df_f.empty:
+    latest_snap = df_f
+else:
+    latest_snap = df_f[df_f["scraped_at"] == df_f["scraped_at"].iloc[-1]]
 
 if latest_snap.empty:
     st.warning("篩選後無最新資料。")
 else:
-    table = latest_snap.merge(
-        growth_df[["platform", "course_name", "growth_rate", "growth_speed", "student_diff"]],
-        on=["platform", "course_name"],
-        how="left",
-    )
+    # growth_df 本來就以 (platform, course_name) 為唯一鍵，建好索引後直接 join
+    growth_idx = growth_df.set_index(["platform", "course_name"])[
+        ["growth_rate", "growth_speed", "student_diff"]
+    ]
+    table = latest_snap.join(growth_idx, on=["platform", "course_name"])
     table["平台"]       = table["platform"].map(PLATFORM_LABEL)
-    table["成長率(%)"]  = table["growth_rate"].apply(
-        lambda x: f"+{x:.1f}" if pd.notna(x) and x > 0 else (f"{x:.1f}" if pd.notna(x) else "—")
-    )
-    table["成長速度(人/天)"] = table["growth_speed"].apply(
-        lambda x: f"+{x:,.1f}" if pd.notna(x) and x > 0 else (f"{x:,.1f}" if pd.notna(x) else "—")
-    )
+    table["成長率(%)"]       = format_signed(table["growth_rate"],  "{:.1f}")
+    table["成長速度(人/天)"] = format_signed(table["growth_speed"], "{:,.1f}")
 
     display = (
         table
@@ -367,9 +528,12 @@ st.divider()
 
 # ── 趨勢折線圖 ────────────────────────────────────────────────────────────────
 
-st.subheader("📉 學生人數趨勢（每日）")
+unique_days = df_f["date"].nunique()
+# 歷史太長時改成每週一點（取該週最後一筆）；預設 90 天的載入範圍仍是每日
+weekly_trend = unique_days > TREND_MAX_DAILY_POINTS
+granularity = "每週" if weekly_trend else "每日"
+st.subheader(f"📉 學生人數趨勢（{granularity}）")
 
-unique_days = df_f["scraped_at"].dt.date.nunique()
 if unique_days < 2:
     st.info("需要至少兩天的資料才能顯示趨勢圖。")
 else:
@@ -378,7 +542,7 @@ else:
         .nlargest(5, "latest_students")["course_name"]
         .tolist()
     )
-    all_course_names = sorted(growth_df["course_name"].unique().tolist())
+    all_course_names = growth_df["course_name"].cat.remove_unused_categories().cat.categories.tolist()
 
     selected = st.multiselect(
         "選擇要比較的課程（最多 10 門）",
@@ -388,17 +552,25 @@ else:
     )
 
     if selected:
-        trend_raw = df_f[df_f["course_name"].isin(selected)].copy()
-        trend_raw["date"] = trend_raw["scraped_at"].dt.date
-
-        # 每天取最後一筆，以「天」為粒度顯示
-        trend = (
-            trend_raw.sort_values("scraped_at")
-                     .groupby(["platform", "course_name", "date"], sort=True)
-                     .last()
-                     .reset_index()
-        )
-        trend["課程"] = trend["platform"].map(PLATFORM_LABEL) + " · " + trend["course_name"]
+        # 直接沿用成長指標的每日彙總（每天取最後一筆），以「天」為粒度顯示
+        trend = daily_df.loc[
+            daily_df["course_name"].isin(selected), ["platform", "course_name", "date", "students"]
+        ]
+        # 只留畫圖用到的三欄，減少送往前端的 JSON 量
+        trend = pd.DataFrame({
+            "date": trend["date"],
+            "students": trend["students"],
+            "課程": (
+                trend["platform"].map(PLATFORM_LABEL).astype(str) + " · " +
+                trend["course_name"].astype(str)
+            ),
+        })
+        if weekly_trend:
+            trend = (
+                trend.groupby(["課程", pd.Grouper(key="date", freq="W")], sort=False)["students"]
+                .last()
+                .reset_index()
+            )
 
         fig = px.line(
             trend,
@@ -406,7 +578,7 @@ else:
             y="students",
             color="課程",
             markers=True,
-            title="學生人數歷史趨勢（每日）",
+            title=f"學生人數歷史趨勢（{granularity}）",
             labels={"date": "日期", "students": "學生人數"},
         )
         fig.update_layout(hovermode="x unified", legend_title="課程")
@@ -426,8 +598,8 @@ else:
         st.info("尚無跨日正向成長資料可顯示。")
     else:
         top_speed["label"] = (
-            top_speed["platform"].map(PLATFORM_LABEL) + " · " +
-            top_speed["course_name"].str[:25]
+            top_speed["platform"].map(PLATFORM_LABEL).astype(str) + " · " +
+            top_speed["course_name"].astype(str).str[:25]
         )
         fig2 = px.bar(
             top_speed,
@@ -460,12 +632,14 @@ if st.session_state.get("is_admin"):
 
     mgmt_platform = st.selectbox(
         "平台",
-        options=sorted(df["platform"].unique()),
+        options=df["platform"].cat.categories.tolist(),
         format_func=lambda x: PLATFORM_LABEL.get(x, x),
         key="mgmt_platform",
     )
-    courses_in_platform = sorted(
-        df[df["platform"] == mgmt_platform]["course_name"].unique()
+    courses_in_platform = (
+        df.loc[df["platform"] == mgmt_platform, "course_name"]
+          .cat.remove_unused_categories()
+          .cat.categories.tolist()
     )
     mgmt_course = st.selectbox("課程", options=courses_in_platform, key="mgmt_course")
 
@@ -493,8 +667,7 @@ if st.session_state.get("is_admin"):
             ids_to_delete = course_hist[
                 course_hist["scraped_at"].dt.strftime("%Y-%m-%d %H:%M:%S").isin(delete_set)
             ]["id"].tolist()
-            sb = get_supabase()
-            sb.table("course_scrapes").delete().in_("id", ids_to_delete).execute()
+            delete_scrapes(ids_to_delete)
             st.success(f"已刪除 {len(ids_to_delete)} 筆紀錄")
             st.cache_data.clear()
             st.rerun()
@@ -502,22 +675,29 @@ if st.session_state.get("is_admin"):
     st.divider()
     st.markdown("**🧹 批次清除**")
 
-    svc_ids = df[df["course_url"].str.contains("/services/", na=False)]["id"].tolist()
-    null_ids = df[df["students"].isna()]["id"].tolist()
+    # 條件交給資料庫判斷（涵蓋整張表，不受目前載入的日期範圍限制）；
+    # 刪除也直接用同一條件，不必把 id 清單塞進 URL
+    svc_count, null_count = cleanup_counts()
+    # 刪除後會 rerun，結果訊息先存進 session_state，rerun 後再顯示
+    if "cleanup_msg" in st.session_state:
+        st.success(st.session_state.pop("cleanup_msg"))
 
     col_a, col_b = st.columns(2)
     with col_a:
-        st.caption(f"服務/工作坊頁面：{len(svc_ids)} 筆")
-        if st.button("🗑 清除服務/工作坊資料", disabled=len(svc_ids) == 0):
-            get_supabase().table("course_scrapes").delete().in_("id", svc_ids).execute()
-            st.success(f"已清除 {len(svc_ids)} 筆")
+        st.caption(f"服務/工作坊頁面：{svc_count} 筆")
+        if st.button("🗑 清除服務/工作坊資料", disabled=svc_count == 0):
+            # 筆數以刪除回應為準（cleanup_counts 有快取，可能已過時）；minimal 不回傳被刪的資料列
+            res = (SB.table("course_scrapes").delete(count="exact", returning="minimal")
+                     .like("course_url", "%/services/%").execute())
+            st.session_state["cleanup_msg"] = f"已清除 {res.count or 0} 筆"
             st.cache_data.clear()
             st.rerun()
     with col_b:
-        st.caption(f"學生數為空：{len(null_ids)} 筆")
-        if st.button("🗑 清除學生數空值資料", disabled=len(null_ids) == 0):
-            get_supabase().table("course_scrapes").delete().in_("id", null_ids).execute()
-            st.success(f"已清除 {len(null_ids)} 筆")
+        st.caption(f"學生數為空：{null_count} 筆")
+        if st.button("🗑 清除學生數空值資料", disabled=null_count == 0):
+            res = (SB.table("course_scrapes").delete(count="exact", returning="minimal")
+                     .is_("students", "null").execute())
+            st.session_state["cleanup_msg"] = f"已清除 {res.count or 0} 筆"
             st.cache_data.clear()
             st.rerun()
 
@@ -9,25 +9,46 @@ Course Scraper（省 credit 版）
      類型（gkOCkQ）與學生數（dvCJUj）；非「課程」項目直接略過。
   3. Hahow 更新：列表已有學生數 → 直接使用；無（預購課）→ 才進內頁。
   4. PressPlay 仍逐一爬個別頁（markdown + regex）。
+  5. 成功的 Firecrawl 回應快取在 data/cache（預設 6 小時，SCRAPE_CACHE_TTL_HOURS 可調），
+     失敗後重跑只重爬失敗的頁面；被擋、沒匹配到學生數的回應不快取。
 
 使用方式：
   python scraper.py              # 只更新學生數（省 credit）
   python scraper.py --discover   # 重新爬列表頁取得課程清單（較貴）
+  python scraper.py --no-cache   # 忽略快取，全部重新爬取
 """
 import os
 import re
 import sys
 import json
+import time
+import asyncio
+import mmap
+import hashlib
 import argparse
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+import httpx
+import lxml.html
+from lxml.etree import XPath
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from typing import List, Optional
 from supabase import create_client
-from firecrawl import FirecrawlApp
-from firecrawl.v2.types import JsonFormat
+from firecrawl import AsyncFirecrawl
+from firecrawl.v2.types import Document, JsonFormat, ScrapeOptions
+from firecrawl.v2.utils.error_handler import RateLimitError
+
+try:
+    import orjson
+except ImportError:   # 沒裝 orjson 時退回標準庫 json
+    orjson = None
+
+try:
+    import h2   # httpx 走 HTTP/2 需要（requirements 的 httpx[http2] 會裝）；沒裝就用 HTTP/1.1 keep-alive
+except ImportError:
+    h2 = None
 
 load_dotenv()
 
@@ -35,6 +56,35 @@ FIRECRAWL_API_KEY = os.getenv("FIRECRAWL_API_KEY")
 SUPABASE_URL      = os.getenv("SUPABASE_URL")
 SUPABASE_KEY      = os.getenv("SUPABASE_KEY")
 COURSE_LIST_FILE  = Path("data/course_list.json")
+# 同時在途的 Firecrawl 請求數（依 Firecrawl 方案的並行上限調整）
+FIRECRAWL_CONCURRENCY = int(os.getenv("FIRECRAWL_CONCURRENCY", "8"))
+LIST_BATCH_TIMEOUT = 180   # 列表頁 batch 等待上限（秒），逾時改為逐頁爬取
+INSERT_CHUNK      = 500  # 每次 insert 的筆數（單次 request 不超過 PostgREST payload 上限）
+INSERT_WORKERS    = 4
+SCRAPE_CACHE_DIR  = Path("data/cache")
+SCRAPE_CACHE_TTL  = float(os.getenv("SCRAPE_CACHE_TTL_HOURS", "6")) * 3600
+SCRAPE_CACHE_ENABLED = True   # --no-cache 時關閉
+COURSE_LIST_MMAP_BYTES = 1 << 20   # 課程清單超過 1 MB 才用 mmap 讀（小檔 read_bytes 較快）
+
+def load_course_list() -> dict[str, list[dict]]:
+    if orjson is not None:
+        if COURSE_LIST_FILE.stat().st_size > COURSE_LIST_MMAP_BYTES:
+            # 大檔直接把 mmap 交給 orjson 解析，不先複製成 bytes
+            with open(COURSE_LIST_FILE, "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                    memoryview(mm) as view:
+                return orjson.loads(view)
+        return orjson.loads(COURSE_LIST_FILE.read_bytes())
+    return json.loads(COURSE_LIST_FILE.read_text(encoding="utf-8"))
+
+def save_course_list(course_list: dict[str, list[dict]]) -> None:
+    # 兩種寫法輸出相同：UTF-8 原字（不跳脫中文）、縮排 2 格
+    if orjson is not None:
+        COURSE_LIST_FILE.write_bytes(orjson.dumps(course_list, option=orjson.OPT_INDENT_2))
+    else:
+        COURSE_LIST_FILE.write_text(
+            json.dumps(course_list, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
 
 def get_supabase():
     if not SUPABASE_URL or not SUPABASE_KEY:
@@ -42,6 +92,98 @@ def get_supabase():
         sys.exit(1)
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# ── Firecrawl 請求 ────────────────────────────────────────────────────────────
+
+# 被限流（429）或回傳空內容時，同一組設定以指數退避重試：等 base * 2^n 秒
+FIRECRAWL_MAX_RETRIES      = int(os.getenv("FIRECRAWL_MAX_RETRIES", "3"))
+FIRECRAWL_RETRY_BASE_DELAY = float(os.getenv("FIRECRAWL_RETRY_BASE_DELAY", "2.0"))
+
+def _is_rate_limited(exc: Exception) -> bool:
+    # 只看例外型別與 HTTP 狀態碼；錯誤訊息裡剛好出現 "429"（網址、筆數）不算限流
+    return isinstance(exc, RateLimitError) or getattr(exc, "status_code", None) == 429
+
+async def enable_connection_pooling(app: AsyncFirecrawl, pool_size: int) -> None:
+    """
+    SDK 的 AsyncHttpClient 建立 httpx.AsyncClient 時關掉了 keep-alive（max_keepalive_connections=0），
+    每個請求都重新 TCP + TLS 握手。換成保留連線（有 h2 時用 HTTP/2）的 client，
+    連線池大小與同時在途請求數一致。
+    """
+    http = app._v2_client.async_http_client
+    old = http._client
+    http._client = httpx.AsyncClient(
+        base_url=old.base_url,
+        headers=old.headers,
+        timeout=old.timeout,
+        http2=h2 is not None,
+        limits=httpx.Limits(max_keepalive_connections=pool_size, max_connections=pool_size * 2),
+    )
+    await old.aclose()
+
+def _flush_log(log: list[str]) -> None:
+    # 整段連同換行一次寫出，各門課的 log 不會互相穿插
+    print("\n".join(log) + "\n", end="", flush=True)
+
+async def _scrape_with_backoff(app: AsyncFirecrawl, sem: asyncio.Semaphore, url: str,
+                               opts: dict, log: list[str]):
+    """
+    爬一次；被限流或回傳空內容時以指數退避重試，最多 FIRECRAWL_MAX_RETRIES 次。
+    等待時不佔 semaphore，讓其他請求先用。
+    """
+    for retry in range(FIRECRAWL_MAX_RETRIES + 1):
+        last = retry == FIRECRAWL_MAX_RETRIES
+        try:
+            async with sem:
+                res = await app.scrape(url, **opts)
+        except Exception as exc:
+            if last or not _is_rate_limited(exc):
+                raise
+            reason = "被限流"
+        else:
+            if res.markdown or res.html or res.json or last:
+                return res
+            reason = "回傳空內容"
+        delay = FIRECRAWL_RETRY_BASE_DELAY * (2 ** retry)
+        log.append(f"    ⏳ {reason}，{delay:g} 秒後重試（{retry + 1}/{FIRECRAWL_MAX_RETRIES}）…")
+        await asyncio.sleep(delay)
+
+# ── Firecrawl 回應快取 ────────────────────────────────────────────────────────
+# 失敗後短時間內重跑時，已成功的頁面直接讀 data/cache，不再花 credit 與等待時間。
+# 只存成功的結果（內頁抓到學生數、列表頁有課程），失敗的回應重跑時一律重爬。
+
+def _cache_path(url: str, options: dict) -> Path:
+    formats = [f if isinstance(f, str) else f.model_dump() for f in options.get("formats", [])]
+    key = json.dumps(
+        [url, formats, options.get("wait_for"), options.get("proxy")],
+        sort_keys=True, ensure_ascii=False,
+    )
+    return SCRAPE_CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+def cache_get(url: str, options: dict) -> Document | None:
+    """快取存在且未過期時回傳 Document，否則 None。"""
+    if not SCRAPE_CACHE_ENABLED:
+        return None
+    path = _cache_path(url, options)
+    try:
+        if time.time() - path.stat().st_mtime > SCRAPE_CACHE_TTL:
+            return None
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    return Document(**data)
+
+def cache_put(url: str, options: dict, res) -> None:
+    if not SCRAPE_CACHE_ENABLED:
+        return
+    data = {k: getattr(res, k, None) for k in ("markdown", "html", "json")}
+    raw = orjson.dumps(data) if orjson is not None else json.dumps(data, ensure_ascii=False).encode("utf-8")
+    path = _cache_path(url, options)
+    SCRAPE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # 先寫暫存檔再 rename，讀的一方不會讀到半個檔案；檔名帶 pid，排程與手動同時跑也不互相覆蓋暫存檔
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(raw)
+    os.replace(tmp, path)
+
 # ── Schema ────────────────────────────────────────────────────────────────────
 
 class CourseLink(BaseModel):
@@ -54,6 +196,9 @@ class CourseLink(BaseModel):
 class CourseLinkPage(BaseModel):
     courses: List[CourseLink]
 
+# JSON schema 只產生一次，各平台的列表頁請求共用
+_COURSE_LINK_PAGE_SCHEMA = CourseLinkPage.model_json_schema()
+
 # ── 平台設定 ──────────────────────────────────────────────────────────────────
 
 PLATFORMS = {
@@ -80,13 +225,14 @@ PLATFORMS = {
             "url (full absolute URL, e.g. https://hahow.in/courses/slug)."
         ),
         "expect_chinese": True,
-        # 內頁 regex（re.DOTALL；非貪婪跳過章節數等小數字）
+        # 內頁 regex，載入時編譯一次（re.DOTALL；非貪婪跳過章節數等小數字）
         # Hahow 頁面學生數固定格式為「X 位同學」，直接匹配即可
         # 當前購買數（募資/預購課）：context 夠精確，允許任意位數
-        "student_patterns": [
-            r"(\d+)\s*位同學",         # 一般課：「147 位同學」、「7380 位同學」
-            r"當前購買數.{0,100}?(\d+)",  # 預購課
-        ],
+        # 每個 pattern 附上必定出現的字面字串，markdown 裡沒有就不必跑 regex
+        "student_patterns": (
+            ("位同學",     re.compile(r"(\d+)\s*位同學", re.DOTALL)),         # 一般課：「147 位同學」、「7380 位同學」
+            ("當前購買數", re.compile(r"當前購買數.{0,100}?(\d+)", re.DOTALL)),  # 預購課
+        ),
     },
     "pressplay": {
         "list_urls": [
@@ -108,26 +254,63 @@ PLATFORMS = {
         ),
         "expect_chinese": True,
         # 匹配：「5,979 人學習」、「123 人預購」，排除「追蹤」
-        "student_patterns": [
-            r"([\d,]+)\s*人學習",
-            r"([\d,]+)\s*人預購",
-        ],
+        "student_patterns": (
+            ("人學習", re.compile(r"([\d,]+)\s*人學習", re.DOTALL)),
+            ("人預購", re.compile(r"([\d,]+)\s*人預購", re.DOTALL)),
+        ),
+        # 集資課（列表顯示達標%）只用「人預購」，避免誤抓達標百分比
+        "funding_student_patterns": (
+            ("人預購", re.compile(r"([\d,]+)\s*人預購", re.DOTALL)),
+        ),
     },
 }
 
+# 沒有集資課設定的平台，集資課也用一般 pattern
+for _config in PLATFORMS.values():
+    _config.setdefault("funding_student_patterns", _config["student_patterns"])
+
+_CHINESE_RE = re.compile(r"[\u4e00-\u9fff]")
+# 非課程頁面（服務、活動）；Hahow 另外要求 URL 含 /courses/，兩個條件併成一個 regex
+_BLOCKED_URL_RE      = re.compile(r"/(?:services|campaigns)/")
+_HAHOW_COURSE_URL_RE = re.compile(r"(?!.*/(?:services|campaigns)/).*/courses/", re.DOTALL)
+def _not_blocked_url(url: str) -> bool:
+    return not _BLOCKED_URL_RE.search(url)
+
+_DIGITS_RE  = re.compile(r"([\d,]+)")
+_THOUSANDS_SEP_TRANS = str.maketrans("", "", ",，")   # 去掉半形、全形逗號
+# URL 的 host 與 path 部分：[scheme:][//host]path[?query][#fragment]
+_URL_PATH_RE = re.compile(r"(?:[A-Za-z][A-Za-z0-9+.-]*:)?(?://(?P<host>[^/?#]*))?(?P<path>[^?#]*)")
+
 # ── 工具函式 ──────────────────────────────────────────────────────────────────
 
 def has_chinese(text: str) -> bool:
-    return bool(re.search(r'[\u4e00-\u9fff]', text))
+    return bool(_CHINESE_RE.search(text))
 
 def parse_int(s: str) -> int:
     """把 '3,210' 之類的字串轉成整數。"""
-    return int(s.replace(",", "").replace("，", ""))
-
-def extract_students_from_markdown(md: str, patterns: list[str]) -> int | None:
-    """用 regex 從 markdown 取出學生數（re.DOTALL 讓 . 跨行）。"""
-    for pat in patterns:
-        m = re.search(pat, md, re.DOTALL)
+    return int(s.translate(_THOUSANDS_SEP_TRANS))
+
+def _fast_path(url: str) -> str:
+    """取 URL 的 path（同 urlparse(url).path，但不必建立整個 ParseResult）。"""
+    return _URL_PATH_RE.match(url).group("path")
+
+def _canonical_url(url: str) -> str:
+    """去重用的 key：只看 path，去掉結尾斜線與 PressPlay 的 /about 子頁。"""
+    path = _fast_path(url).rstrip("/")
+    return path[:-6] if path.endswith("/about") else path
+
+def _course_key(url: str) -> tuple[str, str]:
+    """跨平台去重用的 key：(host, 正規化 path)；host 不分大小寫、忽略 www.。"""
+    host = (_URL_PATH_RE.match(url).group("host") or "").lower()
+    return host.removeprefix("www."), _canonical_url(url)
+
+def extract_students_from_markdown(md: str, regexes: tuple[tuple[str, re.Pattern], ...]) -> int | None:
+    """用預先編譯的 regex 從 markdown 取出學生數（依序嘗試，第一個能轉成整數的為準）。"""
+    # 不併成單一 alternation regex：字面錨點先篩掉不可能的 pattern，實測比合併後掃一次快 2–30 倍
+    for anchor, regex in regexes:
+        if anchor not in md:   # 字面字串比 regex 掃描便宜得多
+            continue
+        m = regex.search(md)
         if m:
             try:
                 return parse_int(m.group(1))
@@ -135,6 +318,52 @@ def extract_students_from_markdown(md: str, patterns: list[str]) -> int | None:
                 continue
     return None
 
+# 列表頁 XPath（在 C 裡一次找完，不在 Python 裡逐層往上走祖先）
+_XPATH_NS = {"re": "http://exslt.org/regular-expressions"}
+
+def _has_class(name: str) -> str:
+    """XPath 條件：class 屬性中含有完整的 name（等同 BeautifulSoup 的 class_="name"）。"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# PressPlay：集資標記（自己或往上 8 層內）最近一個含 /project/ 連結的祖先，取其第一個連結
+_PP_FUNDING_HREFS = XPath(
+    "//*[@data-type='funding']"
+    "/ancestor-or-self::*[position() <= 8][.//a[contains(@href, '/project/')]][1]"
+    "/descendant::a[contains(@href, '/project/')][1]/@href"
+)
+_PP_PROJECT_LINKS = XPath("//a[contains(@href, '/project/')]")
+# 卡片 metadata 的第二個 item 內的 metadata-content
+_PP_STUDENTS_EL = XPath(
+    f"(((.//*[{_has_class('project-card-metadata')}])[1]"
+    f"//*[{_has_class('project-card-metadata-item')}])[2]"
+    f"//*[{_has_class('metadata-content')}])[1]"
+)
+
+# Hahow：類型標籤 → 往上 12 層內最近一個含課程連結的祖先（卡片）→ 連結與學生數
+_HAHOW_TYPE_ELS = XPath("//*[contains(@class, 'gkOCkQ')]")
+_HAHOW_CARD = XPath(
+    r"ancestor::*[position() <= 12][.//a[re:test(@href, '/courses/\w')]][1]",
+    namespaces=_XPATH_NS,
+)
+_HAHOW_CARD_HREF = XPath(
+    r"(.//a[re:test(@href, '/courses/\w')])[1]/@href",
+    namespaces=_XPATH_NS,
+)
+_HAHOW_STUDENTS_EL = XPath("(.//*[contains(@class, 'dvCJUj')])[1]")
+
+def _stripped_text(el) -> str:
+    """各段文字去頭尾空白後串接（同 BeautifulSoup 的 get_text(strip=True)）。"""
+    return "".join(t.strip() for t in el.itertext())
+
+def _first_int(text: str) -> int | None:
+    m = _DIGITS_RE.search(text)
+    if m:
+        try:
+            return parse_int(m.group(1))
+        except ValueError:
+            pass
+    return None
+
 def parse_pressplay_listing_html(html: str) -> dict[str, dict]:
     """
     解析 PressPlay 列表頁 HTML。
@@ -143,26 +372,15 @@ def parse_pressplay_listing_html(html: str) -> dict[str, dict]:
     - students：非集資課從卡片第二個 project-card-metadata-item > metadata-content 取得
       （若該結構不存在則 students=None，仍進內頁）
     """
-    from bs4 import BeautifulSoup
-    soup = BeautifulSoup(html, "html.parser")
+    tree = lxml.html.fromstring(html)
     result: dict[str, dict] = {}
 
     # 找出集資課 URL（有 data-type="funding" 屬性的卡片）
-    funding_paths: set[str] = set()
-    for el in soup.find_all(attrs={"data-type": "funding"}):
-        ancestor = el
-        for _ in range(8):
-            if ancestor is None:
-                break
-            lnk = ancestor.find("a", href=re.compile(r"/project/"))
-            if lnk:
-                funding_paths.add(lnk.get("href", "").split("?")[0].rstrip("/"))
-                break
-            ancestor = getattr(ancestor, "parent", None)
+    funding_paths = {href.split("?")[0].rstrip("/") for href in _PP_FUNDING_HREFS(tree)}
 
     # 逐一處理卡片
     seen: set[str] = set()
-    for link in soup.find_all("a", href=re.compile(r"/project/")):
+    for link in _PP_PROJECT_LINKS(tree):
         raw_path = link.get("href", "").split("?")[0].rstrip("/")
         if not raw_path or raw_path in seen:
             continue
@@ -173,19 +391,9 @@ def parse_pressplay_listing_html(html: str) -> dict[str, dict]:
 
         if not is_funding:
             # 第二個 project-card-metadata-item 內的 metadata-content 就是學生數
-            metadata = link.find(class_="project-card-metadata")
-            if metadata:
-                items = metadata.find_all(class_="project-card-metadata-item")
-                if len(items) >= 2:
-                    content_el = items[1].find(class_="metadata-content")
-                    if content_el:
-                        text = content_el.get_text(strip=True)
-                        m = re.search(r"([\d,]+)", text)
-                        if m:
-                            try:
-                                students = parse_int(m.group(1))
-                            except ValueError:
-                                pass
+            content_els = _PP_STUDENTS_EL(link)
+            if content_els:
+                students = _first_int(_stripped_text(content_els[0]))
 
         result[raw_path] = {"is_funding": is_funding, "students": students}
 
@@ -196,41 +404,23 @@ def parse_hahow_listing_html(html: str) -> dict[str, dict]:
     解析 Hahow 列表頁 HTML，透過 CSS class substring 找出每張課程卡片的類型與學生數。
     回傳 {"/courses/<slug>": {"type": "課程"|..., "students": int|None}}
     """
-    from bs4 import BeautifulSoup
-    soup = BeautifulSoup(html, "html.parser")
+    tree = lxml.html.fromstring(html)
     result: dict[str, dict] = {}
 
     # 每張課程卡片包含一個 class 含 "gkOCkQ" 的元素（顯示類型：課程/補給/服務…）
-    for type_el in soup.find_all(class_=re.compile(r"gkOCkQ")):
+    for type_el in _HAHOW_TYPE_ELS(tree):
         # 往上找包含 /courses/ 連結的祖先元素
-        ancestor = type_el.parent
-        link_el = None
-        for _ in range(12):
-            if ancestor is None:
-                break
-            link_el = ancestor.find("a", href=re.compile(r"/courses/\w"))
-            if link_el:
-                break
-            ancestor = ancestor.parent
-
-        if not link_el:
+        cards = _HAHOW_CARD(type_el)
+        if not cards:
             continue
+        card = cards[0]
 
-        url_path = link_el.get("href", "")         # e.g. "/courses/5a211b15..."
-        course_type = type_el.get_text(strip=True)  # "課程" / "補給" / "服務" …
+        url_path = _HAHOW_CARD_HREF(card)[0]       # e.g. "/courses/5a211b15..."
+        course_type = _stripped_text(type_el)       # "課程" / "補給" / "服務" …
 
         # 在同一卡片中找學生數（class 含 "dvCJUj"）
-        students = None
-        if ancestor:
-            student_el = ancestor.find(class_=re.compile(r"dvCJUj"))
-            if student_el:
-                text = student_el.get_text(strip=True)
-                m = re.search(r"([\d,]+)", text)
-                if m:
-                    try:
-                        students = parse_int(m.group(1))
-                    except ValueError:
-                        pass
+        student_els = _HAHOW_STUDENTS_EL(card)
+        students = _first_int(_stripped_text(student_els[0])) if student_els else None
 
         result[url_path] = {"type": course_type, "students": students}
 
@@ -238,216 +428,356 @@ def parse_hahow_listing_html(html: str) -> dict[str, dict]:
 
 # ── Discover 模式：爬列表頁取得課程清單（消耗 LLM credits）───────────────────
 
-def discover_courses(app: FirecrawlApp) -> dict[str, list[dict]]:
-    """爬各平台列表頁（支援多頁），回傳 {platform: [course_dict, ...]}。"""
-    result: dict[str, list[dict]] = {}
-
-    for platform, config in PLATFORMS.items():
-        list_urls   = config.get("list_urls", [])
-        max_courses = config.get("max_courses", 50)
-        seen_urls: set[str] = set()
-        all_courses: list[dict] = []
-
-        for page_url in list_urls:
-            if len(all_courses) >= max_courses:
-                break
-            print(f"\n  [{platform}] 爬列表頁 → {page_url}")
-            try:
-                formats = ["markdown", JsonFormat(
-                    type="json",
-                    prompt=config["list_prompt"],
-                    schema=CourseLinkPage.model_json_schema(),
-                )]
-                if platform in ("hahow", "pressplay"):
-                    formats = ["html"] + formats  # 額外取 HTML 供 CSS 選擇器解析
-                res = app.scrape(
-                    url=page_url,
-                    formats=formats,
-                    wait_for=8000,
-                    proxy="stealth",
-                )
-            except Exception as exc:
-                print(f"  [{platform}] ✗ 列表頁爬取失敗：{exc}")
+def _has_courses(doc) -> bool:
+    """列表頁的 LLM 結構化結果裡有課程才算成功（才值得快取）。"""
+    data = getattr(doc, "json", None)
+    return isinstance(data, dict) and bool(data.get("courses"))
+
+async def scrape_list_pages(app: AsyncFirecrawl, sem: asyncio.Semaphore, platform: str,
+                            urls: list[str], formats: list) -> list[tuple[str, object | None]]:
+    """
+    一次送出同平台所有列表頁（batch scrape，由 Firecrawl 端並行），
+    回傳與 urls 同順序的 [(page_url, document 或 None), ...]。
+    快取內仍有效的頁面不重爬；batch 失敗、逾時，或沒有回傳某一頁時，
+    那些頁面退回逐頁 scrape（同樣受 sem 限制）。
+    """
+    options = dict(formats=formats, wait_for=8000, proxy="stealth")
+    results = {url: cache_get(url, options) for url in urls}
+    misses = [url for url in urls if results[url] is None]
+    if len(misses) < len(urls):
+        print(f"\n  [{platform}] 快取命中 {len(urls) - len(misses)} 頁列表頁")
+    if not misses:
+        return [(url, results[url]) for url in urls]
+
+    print(f"\n  [{platform}] 批次爬列表頁（{len(misses)} 頁）…")
+    returned: set[str] = set()
+    try:
+        # batch 整個 job 只佔一個名額（輪詢結果期間也算在途）
+        async with sem:
+            job = await app.batch_scrape(misses, options=ScrapeOptions(**options),
+                                         timeout=LIST_BATCH_TIMEOUT)
+        for doc in job.data:
+            meta = doc.metadata_typed
+            # source_url 是送出的網址；被轉址時 url 會是最終網址，只有對得上送出的網址才算數
+            url = next((u for u in (meta.source_url, meta.url) if u in misses), None)
+            if url is None:
+                print(f"  [{platform}] ⚠ batch 回傳無法對應的頁面：{meta.source_url or meta.url}")
                 continue
+            returned.add(url)
+            if meta.error:
+                print(f"  [{platform}] ✗ 列表頁爬取失敗：{url} {meta.error}")
+                continue
+            results[url] = doc
+            if _has_courses(doc):
+                cache_put(url, options, doc)
+        for url in misses:
+            if url not in returned:
+                print(f"  [{platform}] ⚠ batch 沒有回傳此頁，改為單頁爬取：{url}")
+    except Exception as exc:
+        print(f"  [{platform}] ⚠ batch scrape 失敗（{exc}），改為逐頁爬取")
+
+    async def scrape_page(url: str):
+        log: list[str] = []
+        try:
+            res = await _scrape_with_backoff(app, sem, url, options, log)
+            if _has_courses(res):
+                cache_put(url, options, res)
+        except Exception as exc:
+            log.append(f"  [{platform}] ✗ 列表頁爬取失敗：{url} {exc}")
+            res = None
+        if log:
+            _flush_log(log)
+        return res
+
+    retry = [url for url in misses if url not in returned]
+    if retry:
+        pages = await asyncio.gather(*(scrape_page(url) for url in retry))
+        results.update(zip(retry, pages))
+    return [(url, results[url]) for url in urls]
+
+def _list_page_formats(config: dict) -> list:
+    # 列表頁只用得到 LLM 結構化結果與 HTML（解析卡片類型/學生數），不取 markdown
+    return ["html", JsonFormat(
+        type="json",
+        prompt=config["list_prompt"],
+        schema=_COURSE_LINK_PAGE_SCHEMA,
+    )]
+
+def _collect_courses(platform: str, config: dict, pages: list[tuple[str, object | None]],
+                     seen: set[tuple[str, str]]) -> list[dict]:
+    """
+    過濾、補上列表 HTML 的學生數並去重，回傳該平台最多 max_courses 門課。
+    seen 由所有平台共用，已收錄過的課程（含其他平台）不會重複加入。
+    """
+    max_courses = config.get("max_courses", 50)
+    needs_chinese = config.get("expect_chinese", False)
+    # Hahow 課程 URL 必須包含 /courses/；其他平台只排除服務、活動頁
+    if platform == "hahow":
+        is_course_url = _HAHOW_COURSE_URL_RE.match
+    else:
+        is_course_url = _not_blocked_url
+    all_courses: list[dict] = []
+
+    for page_url, res in pages:
+        if len(all_courses) >= max_courses:
+            break
+        print(f"\n  [{platform}] 列表頁 → {page_url}")
+        if res is None:
+            continue
 
-            md = res.markdown or ""
-            if not md:
-                print(f"  [{platform}] ⚠ markdown 為空")
+        data = res.json
+        if not data:
+            print(f"  [{platform}] ✗ 無結構化資料")
+            continue
 
-            data = res.json
-            if not data:
-                print(f"  [{platform}] ✗ 無結構化資料")
-                continue
+        courses = data.get("courses", []) if isinstance(data, dict) else []
 
-            courses = data.get("courses", []) if isinstance(data, dict) else []
-
-            # 防幻覺：過濾無中文課程名
-            if config.get("expect_chinese"):
-                before = len(courses)
-                courses = [c for c in courses if has_chinese(c.get("course_name", ""))]
-                if before - len(courses):
-                    print(f"  [{platform}] ⚠ 過濾 {before - len(courses)} 筆幻覺課程")
-
-            # 過濾非課程頁面
-            before_svc = len(courses)
-            url_blocklist = ["/services/", "/campaigns/"]
-            # Hahow 課程 URL 必須包含 /courses/
-            if platform == "hahow":
-                courses = [
-                    c for c in courses
-                    if "/courses/" in c.get("url", "")
-                    and all(b not in c.get("url", "") for b in url_blocklist)
-                ]
+        # 一次走完：防幻覺（無中文課程名）→ 非課程頁面，兩種各自計數
+        kept: list[dict] = []
+        hallucinated = non_course = 0
+        for c in courses:
+            if needs_chinese and not has_chinese(c.get("course_name", "")):
+                hallucinated += 1
+            elif not is_course_url(c.get("url", "")):
+                non_course += 1
             else:
-                courses = [
-                    c for c in courses
-                    if all(b not in c.get("url", "") for b in url_blocklist)
-                ]
-            if before_svc - len(courses):
-                print(f"  [{platform}] ⚠ 過濾 {before_svc - len(courses)} 筆非課程頁面")
-
-            # Hahow：用 HTML 解析列表頁取得類型與學生數
-            if platform == "hahow":
-                html = getattr(res, "html", None) or ""
-                if html:
-                    from urllib.parse import urlparse
-                    card_data = parse_hahow_listing_html(html)
-                    # debug log
-                    types_found = {v["type"] for v in card_data.values() if v.get("type")}
-                    students_found = sum(1 for v in card_data.values() if v.get("students") is not None)
-                    print(f"  [hahow] HTML 解析：{len(card_data)} 卡片，類型={types_found}，有學生數={students_found}")
-                    enriched = []
-                    for c in courses:
-                        path = urlparse(c.get("url", "")).path  # "/courses/xxx"
-                        info = card_data.get(path, {})
-                        if info.get("type") and info["type"] != "課程":
-                            print(f"  [hahow] ⚠ 跳過「{info['type']}」: {c.get('course_name')}")
-                            continue
-                        c["students"] = info.get("students")
-                        enriched.append(c)
-                    courses = enriched
-                else:
-                    print(f"  [hahow] ⚠ HTML 為空，略過 CSS 選擇器過濾")
-
-            # PressPlay：從列表 HTML 取學生數；集資課標記後進內頁
-            if platform == "pressplay":
-                html = getattr(res, "html", None) or ""
-                if html:
-                    from urllib.parse import urlparse
-                    card_data = parse_pressplay_listing_html(html)
-                    funding_count  = sum(1 for v in card_data.values() if v["is_funding"])
-                    students_found = sum(1 for v in card_data.values() if v.get("students") is not None)
-                    print(f"  [pressplay] HTML 解析：集資課={funding_count}，有學生數={students_found}")
-                    for c in courses:
-                        raw  = urlparse(c.get("url", "")).path.rstrip("/")
-                        path = raw[:-6] if raw.endswith("/about") else raw
-                        info = card_data.get(path, card_data.get(raw, {}))
-                        c["is_funding"] = info.get("is_funding", False)
-                        c["students"]   = info.get("students")  # None → 進內頁
-                else:
-                    print(f"  [pressplay] ⚠ HTML 為空，略過集資課偵測")
-
-            # 跨頁去重（以 URL 為 key）
-            for c in courses:
-                url = c.get("url", "")
-                if url and url not in seen_urls:
-                    seen_urls.add(url)
-                    all_courses.append(c)
-
-            print(f"  [{platform}] 本頁新增 {len(courses)} 門，累計 {len(all_courses)} 門")
-
-        all_courses = all_courses[:max_courses]
-        print(f"  [{platform}] ✓ 最終 {len(all_courses)} 門課程")
-        result[platform] = all_courses
+                kept.append(c)
+        courses = kept
+        if hallucinated:
+            print(f"  [{platform}] ⚠ 過濾 {hallucinated} 筆幻覺課程")
+        if non_course:
+            print(f"  [{platform}] ⚠ 過濾 {non_course} 筆非課程頁面")
+
+        # Hahow：用 HTML 解析列表頁取得類型與學生數
+        if platform == "hahow":
+            html = getattr(res, "html", None) or ""
+            if html:
+                card_data = parse_hahow_listing_html(html)
+                # debug log
+                types_found = {v["type"] for v in card_data.values() if v.get("type")}
+                students_found = sum(1 for v in card_data.values() if v.get("students") is not None)
+                print(f"  [hahow] HTML 解析：{len(card_data)} 卡片，類型={types_found}，有學生數={students_found}")
+                enriched = []
+                for c in courses:
+                    path = _fast_path(c.get("url", ""))  # "/courses/xxx"
+                    info = card_data.get(path, {})
+                    if info.get("type") and info["type"] != "課程":
+                        print(f"  [hahow] ⚠ 跳過「{info['type']}」: {c.get('course_name')}")
+                        continue
+                    c["students"] = info.get("students")
+                    enriched.append(c)
+                courses = enriched
+            else:
+                print(f"  [hahow] ⚠ HTML 為空，略過 CSS 選擇器過濾")
+
+        # PressPlay：從列表 HTML 取學生數；集資課標記後進內頁
+        if platform == "pressplay":
+            html = getattr(res, "html", None) or ""
+            if html:
+                card_data = parse_pressplay_listing_html(html)
+                funding_count  = sum(1 for v in card_data.values() if v["is_funding"])
+                students_found = sum(1 for v in card_data.values() if v.get("students") is not None)
+                print(f"  [pressplay] HTML 解析：集資課={funding_count}，有學生數={students_found}")
+                for c in courses:
+                    raw  = _fast_path(c.get("url", "")).rstrip("/")
+                    path = _canonical_url(c.get("url", ""))
+                    info = card_data.get(path, card_data.get(raw, {}))
+                    c["is_funding"] = info.get("is_funding", False)
+                    c["students"]   = info.get("students")  # None → 進內頁
+            else:
+                print(f"  [pressplay] ⚠ HTML 為空，略過集資課偵測")
 
-    return result
+        # 跨頁、跨平台去重（host + 正規化 path：結尾斜線、?query、/about 都算同一門）
+        for c in courses:
+            key = _course_key(c.get("url", ""))
+            if key[1] and key not in seen:
+                seen.add(key)
+                all_courses.append(c)
 
-# ── Update 模式 ───────────────────────────────────────────────────────────────
+        print(f"  [{platform}] 本頁新增 {len(courses)} 門，累計 {len(all_courses)} 門")
 
-def update_student_counts(app: FirecrawlApp, course_list: dict[str, list[dict]]) -> list[dict]:
-    """更新學生數：列表頁已有數值則直接使用；PressPlay 集資課一律進內頁用「人預購」。"""
-    rows: list[dict] = []
-    scraped_at = datetime.now().isoformat(timespec="seconds")
+    all_courses = all_courses[:max_courses]
+    print(f"  [{platform}] ✓ 最終 {len(all_courses)} 門課程")
+    return all_courses
+
+async def discover_courses(app: AsyncFirecrawl, sem: asyncio.Semaphore) -> dict[str, list[dict]]:
+    """爬各平台列表頁（支援多頁），回傳 {platform: [course_dict, ...]}。"""
+    # 各平台的列表頁同時送出（同一個 sem 控制在途請求數），全部回來後再逐平台整理
+    all_pages = await asyncio.gather(*(
+        scrape_list_pages(app, sem, platform, config.get("list_urls", []), _list_page_formats(config))
+        for platform, config in PLATFORMS.items()
+    ))
+    seen: set[tuple[str, str]] = set()
+    return {
+        platform: _collect_courses(platform, config, pages, seen)
+        for (platform, config), pages in zip(PLATFORMS.items(), all_pages)
+    }
+
+# ── Update 模式 ───────────────────────────────────────────────────────────────
 
+# 內頁爬取策略：先用 stealth proxy；
+# 若 markdown 太短（<1500字，疑似被擋）或沒匹配 → 改用無 proxy、長等待重試
+UPDATE_ATTEMPTS = [
+    {"formats": ["markdown"], "proxy": "stealth", "wait_for": 5000},
+    {"formats": ["markdown"], "wait_for": 15000},   # 長等待 fallback（某些頁面需要 >5s 渲染）
+]
+MIN_MARKDOWN_CHARS = 1500
+
+def _build_update_jobs(course_list: dict[str, list[dict]]) -> list[tuple]:
+    """攤平成 (platform, rank, total, course, patterns) 工作清單，順序即課程清單順序。"""
+    jobs = []
     for platform, courses in course_list.items():
         config = PLATFORMS.get(platform, {})
-        patterns = config.get("student_patterns", [])
         print(f"\n  [{platform}] 更新學生數（{len(courses)} 門）…")
-
         for rank, course in enumerate(courses, start=1):
-            url = course.get("url", "").strip()
-            name = course.get("course_name", f"課程{rank}")
-
-            # 若 discover 時已從列表頁取得學生數，直接使用，不進內頁
-            existing = course.get("students")
-            if existing is not None:
-                print(f"  [{rank}/{len(courses)}] {name} → {existing}（列表已知，略過內頁）")
-                rows.append({
-                    "platform":    platform,
-                    "rank":        rank,
-                    "course_name": course.get("course_name", ""),
-                    "teacher":     course.get("teacher", ""),
-                    "price":       course.get("price"),
-                    "students":    existing,
-                    "course_url":  url,
-                    "scraped_at":  scraped_at,
-                })
-                continue
-
-            # 集資課只用「人預購」pattern，避免誤抓達標百分比
-            if platform == "pressplay" and course.get("is_funding"):
-                course_patterns = [r"([\d,]+)\s*人預購"]
-                print(f"  [{rank}/{len(courses)}] {name}（集資課，進內頁抓人預購）")
-            else:
-                course_patterns = patterns
-                print(f"  [{rank}/{len(courses)}] {name}")
-
-            students = None
-            if url and url.startswith("http"):
-                # 策略：先用 stealth proxy；
-                # 若 markdown 太短（<1500字，疑似被擋）→ 改用無 proxy 重試
-                attempts = [
-                    {"proxy": "stealth", "wait_for": 5000},
-                    {"proxy": None,      "wait_for": 15000},  # 長等待 fallback（某些頁面需要 >5s 渲染）
-                ]
-                for attempt_no, opt in enumerate(attempts, start=1):
+            # 建工作清單時就決定用哪組 pattern（集資課 / 一般課），不必在每次爬取時判斷
+            key = "funding_student_patterns" if course.get("is_funding") else "student_patterns"
+            jobs.append((platform, rank, len(courses), course, config.get(key, ())))
+    return jobs
+
+def _course_log_header(platform: str, rank: int, total: int, course: dict) -> str:
+    tag = f"  [{platform} {rank}/{total}]"
+    name = course.get("course_name", f"課程{rank}")
+    if course.get("students") is not None:
+        return f"{tag} {name} → {course['students']}（列表已知，略過內頁）"
+    if course.get("is_funding"):
+        return f"{tag} {name}（集資課，進內頁抓人預購）"
+    return f"{tag} {name}"
+
+def _check_markdown(md: str, attempt_no: int, patterns, log: list[str]) -> tuple[int | None, bool]:
+    """判斷一次爬取結果：回傳 (學生數, 是否該停止重試)。"""
+    last = attempt_no == len(UPDATE_ATTEMPTS)
+    if len(md) < MIN_MARKDOWN_CHARS and not last:
+        log.append(f"    ⚠ 第{attempt_no}次 markdown 過短({len(md)}字)，改用無proxy重試…")
+        return None, False
+    students = extract_students_from_markdown(md, patterns)
+    if students is None and not last:
+        log.append(f"    ⚠ 第{attempt_no}次未匹配，改用無proxy重試…")
+        return None, False
+    return students, True
+
+def _nan_to_none(v):
+    return None if v is not None and v != v else v
+
+def _course_row(platform: str, rank: int, course: dict, students: int | None) -> dict:
+    """
+    組成寫入 Supabase 的 row；數值欄在這裡就把 NaN 轉成 null，寫入前不必再掃一遍。
+    scraped_at 整次執行都一樣，由 insert_rows 寫入時補上。
+    """
+    return {
+        "platform":    platform,
+        "rank":        rank,
+        "course_name": course.get("course_name", ""),
+        "teacher":     course.get("teacher", ""),
+        "price":       _nan_to_none(course.get("price")),
+        "students":    _nan_to_none(students),
+        "course_url":  course.get("url", "").strip(),
+    }
+
+async def _scrape_one(app: AsyncFirecrawl, sem: asyncio.Semaphore, platform: str,
+                      rank: int, total: int, course: dict,
+                      patterns: tuple[tuple[str, re.Pattern], ...]) -> dict:
+    """
+    取得單一課程的學生數並組成一筆 row；同時在途的 Firecrawl 請求數由 sem 控制。
+    log 先收集起來最後一次印出，避免多門課的輸出交錯。
+    """
+    url = course.get("url", "").strip()
+    log = [_course_log_header(platform, rank, total, course)]
+
+    # 若 discover 時已從列表頁取得學生數，直接使用，不進內頁
+    students = course.get("students")
+    if students is None:
+        if url.startswith("http"):
+            for attempt_no, opts in enumerate(UPDATE_ATTEMPTS, start=1):
+                res = cache_get(url, opts)
+                fetched = res is None
+                if fetched:
                     try:
-                        scrape_kwargs = dict(
-                            url=url,
-                            formats=["markdown"],
-                            wait_for=opt["wait_for"],
-                        )
-                        if opt["proxy"]:
-                            scrape_kwargs["proxy"] = opt["proxy"]
-                        res = app.scrape(**scrape_kwargs)
-                        md = res.markdown or ""
-                        if len(md) < 1500 and attempt_no < len(attempts):
-                            print(f"    ⚠ 第{attempt_no}次 markdown 過短({len(md)}字)，改用無proxy重試…")
-                            continue
-                        students = extract_students_from_markdown(md, course_patterns)
-                        if students is not None:
-                            break
-                        if attempt_no < len(attempts):
-                            print(f"    ⚠ 第{attempt_no}次未匹配，改用無proxy重試…")
+                        res = await _scrape_with_backoff(app, sem, url, opts, log)
                     except Exception as exc:
-                        print(f"    ✗ 爬取失敗（第{attempt_no}次）：{exc}")
+                        log.append(f"    ✗ 爬取失敗（第{attempt_no}次）：{exc}")
                         break
-                print(f"    學生數：{students}")
-            else:
-                print(f"    ⚠ 無效 URL，跳過")
-
-            rows.append({
-                "platform":    platform,
-                "rank":        rank,
-                "course_name": course.get("course_name", ""),
-                "teacher":     course.get("teacher", ""),
-                "price":       course.get("price"),
-                "students":    students,
-                "course_url":  url,
-                "scraped_at":  scraped_at,
-            })
-
-    return rows
+                students, done = _check_markdown(res.markdown or "", attempt_no, patterns, log)
+                # 只快取抓得到學生數的回應；被擋、過短、沒匹配的下次重跑要重爬
+                if fetched and students is not None:
+                    cache_put(url, opts, res)
+                if done:
+                    break
+            log.append(f"    學生數：{students}")
+        else:
+            log.append(f"    ⚠ 無效 URL，跳過")
+
+    _flush_log(log)
+    return _course_row(platform, rank, course, students)
+
+async def update_student_counts(app: AsyncFirecrawl, sem: asyncio.Semaphore,
+                                course_list: dict[str, list[dict]]) -> list[dict]:
+    """
+    更新學生數：列表頁已有數值則直接使用；PressPlay 集資課一律進內頁用「人預購」。
+    各課程內頁互不相關，在單一 event loop 上同時爬，semaphore 限制同時在途的請求數為
+    FIRECRAWL_CONCURRENCY；回傳順序與課程清單相同。
+    """
+    jobs = _build_update_jobs(course_list)
+
+    print(f"\n  同時爬取 {FIRECRAWL_CONCURRENCY} 個內頁…")
+    # gather 依傳入順序回傳，不必再排序
+    rows = await asyncio.gather(*(_scrape_one(app, sem, *job) for job in jobs))
+    return list(rows)
+
+async def scrape_courses(discover: bool) -> list[dict]:
+    """取得課程清單並更新學生數；列表頁與內頁共用同一個 AsyncFirecrawl 與 semaphore。"""
+    app = AsyncFirecrawl(api_key=FIRECRAWL_API_KEY)
+    sem = asyncio.Semaphore(FIRECRAWL_CONCURRENCY)
+    await enable_connection_pooling(app, FIRECRAWL_CONCURRENCY)
+    try:
+        # 取得課程清單
+        if discover:
+            print("\n【發現模式】爬列表頁取得課程清單…")
+            course_list = await discover_courses(app, sem)
+            course_list = {k: v for k, v in course_list.items() if v}
+            if not course_list:
+                print("✗ 無法取得任何課程清單，程式結束。")
+                sys.exit(1)
+            save_course_list(course_list)
+            print(f"✓ 課程清單已存至 {COURSE_LIST_FILE}")
+        else:
+            course_list = load_course_list()
+            total = sum(len(v) for v in course_list.values())
+            print(f"\n【更新模式】使用快取清單（{total} 門課），只更新學生數")
+            print(f"  提示：加 --discover 參數可重新發現新課程")
+
+        # 更新學生數
+        return await update_student_counts(app, sem, course_list)
+    finally:
+        # SDK 沒有公開的 close，直接關掉底下的 httpx client
+        await app._v2_client.async_http_client.close()
+
+# ── 寫入 Supabase ─────────────────────────────────────────────────────────────
+
+def chunked(seq: list, n: int):
+    """依序切成 n 筆一批，連同該批起始 index 一起回傳。"""
+    for i in range(0, len(seq), n):
+        yield i, seq[i:i + n]
+
+def insert_rows(sb, rows: list[dict], scraped_at: str) -> int:
+    """
+    分批（INSERT_CHUNK 筆）並行寫入，單批失敗只影響該批；回傳成功寫入的筆數。
+    每筆都補上同一個 scraped_at：儀表板以完全相同的 scraped_at 辨識同一次爬取，
+    不能交給資料庫 default now()（各批寫入時間不同）。
+    """
+    def insert(start: int, batch: list[dict]) -> int:
+        for row in batch:
+            row["scraped_at"] = scraped_at
+        try:
+            sb.table("course_scrapes").insert(batch).execute()
+            return len(batch)
+        except Exception as exc:
+            # 印出該批的 row 範圍，方便找出是哪幾筆出問題
+            print(f"  ✗ 寫入失敗（第 {start}–{start + len(batch) - 1} 筆，共 {len(batch)} 筆）：{exc}")
+            return 0
+
+    with ThreadPoolExecutor(max_workers=INSERT_WORKERS) as ex:
+        return sum(ex.map(lambda b: insert(*b), chunked(rows, INSERT_CHUNK)))
 
 # ── 主程式 ────────────────────────────────────────────────────────────────────
 
@@ -455,49 +785,34 @@ def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--discover", action="store_true",
                         help="重新爬列表頁取得課程清單（會消耗較多 credits）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不讀寫 data/cache 的 Firecrawl 回應快取，一律重新爬取")
     args = parser.parse_args()
 
+    global SCRAPE_CACHE_ENABLED
+    SCRAPE_CACHE_ENABLED = not args.no_cache
+
     if not FIRECRAWL_API_KEY:
         print("錯誤：請在 .env 中設定 FIRECRAWL_API_KEY")
         sys.exit(1)
 
     COURSE_LIST_FILE.parent.mkdir(parents=True, exist_ok=True)
-    sb  = get_supabase()
-    app = FirecrawlApp(api_key=FIRECRAWL_API_KEY)
-
-    print(f"\n=== 開始爬取 {datetime.now().isoformat(timespec='seconds')} ===")
-
-    # 取得課程清單
-    if args.discover or not COURSE_LIST_FILE.exists():
-        print("\n【發現模式】爬列表頁取得課程清單…")
-        course_list = discover_courses(app)
-        course_list = {k: v for k, v in course_list.items() if v}
-        if not course_list:
-            print("✗ 無法取得任何課程清單，程式結束。")
-            sys.exit(1)
-        COURSE_LIST_FILE.write_text(
-            json.dumps(course_list, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
-        print(f"✓ 課程清單已存至 {COURSE_LIST_FILE}")
-    else:
-        course_list = json.loads(COURSE_LIST_FILE.read_text(encoding="utf-8"))
-        total = sum(len(v) for v in course_list.values())
-        print(f"\n【更新模式】使用快取清單（{total} 門課），只更新學生數")
-        print(f"  提示：加 --discover 參數可重新發現新課程")
+    sb = get_supabase()
 
-    # 更新學生數
-    rows = update_student_counts(app, course_list)
+    # 整次執行共用一個時間戳
+    scraped_at = datetime.now().isoformat(timespec="seconds")
+    print(f"\n=== 開始爬取 {scraped_at} ===")
+    rows = asyncio.run(scrape_courses(args.discover or not COURSE_LIST_FILE.exists()))
 
     if not rows:
         print("\n✗ 未取得任何資料。")
         sys.exit(1)
 
-    # 寫入 Supabase（None 值轉成 null）
-    clean_rows = [
-        {k: (None if v != v or v is None else v) for k, v in row.items()}
-        for row in rows
-    ]
-    sb.table("course_scrapes").insert(clean_rows).execute()
+    # 寫入 Supabase
+    saved = insert_rows(sb, rows, scraped_at)
+    if saved < len(rows):
+        print(f"\n✗ 只儲存 {saved}/{len(rows)} 筆，請檢查上方錯誤訊息")
+        sys.exit(1)
     print(f"\n✓ 儲存 {len(rows)} 筆新資料 → Supabase")
     print(f"=== 爬取完成 ===\n")
 
@@ -8,7 +8,6 @@
 """
 import re
 import sys
-import json
 from pathlib import Path
 from dotenv import load_dotenv
 import os
@@ -16,21 +15,20 @@ import os
 load_dotenv(Path(__file__).parent / ".env")
 
 from firecrawl import FirecrawlApp
+from scraper import COURSE_LIST_FILE, PLATFORMS, load_course_list, parse_int
 
-COURSE_LIST_FILE = Path("data/course_list.json")
-PATTERNS = [
-    r"(\d+)\s*位同學",            # 一般課
-    r"當前購買數.{0,100}?(\d+)",  # 預購課
-]
-
-def parse_int(s: str) -> int:
-    return int(s.replace(",", "").replace("，", ""))
+# 直接用 scraper 的 Hahow pattern，測的就是正式爬取時的規則
+PATTERNS = PLATFORMS["hahow"]["student_patterns"]
+# 除錯用：所有錨點字串併成一個 regex，一次掃過 markdown 找出各關鍵字
+KEYWORD_RE = re.compile("|".join(re.escape(anchor) for anchor, _ in PATTERNS))
 
 def extract_students(md: str):
-    for pat in PATTERNS:
-        m = re.search(pat, md, re.DOTALL)
+    for anchor, regex in PATTERNS:
+        if anchor not in md:
+            continue
+        m = regex.search(md)
         if m:
-            return parse_int(m.group(1)), pat
+            return parse_int(m.group(1)), regex.pattern
     return None, None
 
 def test_url(app: FirecrawlApp, url: str, name: str = "", wait_ms: int = 5000):
@@ -49,17 +47,17 @@ def test_url(app: FirecrawlApp, url: str, name: str = "", wait_ms: int = 5000):
     else:
         print(f"✗ 未匹配任何 pattern（markdown 共 {len(md)} 字）")
         # 搜尋學生數關鍵字，印出前後 80 字
-        keywords = ["位同學", "當前購買數"]
-        found_any = False
-        for kw in keywords:
-            idx = md.find(kw)
-            if idx != -1:
-                start = max(0, idx - 80)
-                end = min(len(md), idx + 120)
-                print(f"\n  關鍵字「{kw}」出現在位置 {idx}：")
-                print(f"  ...{md[start:end]}...")
-                found_any = True
-        if not found_any:
+        first_pos: dict[str, int] = {}
+        for m in KEYWORD_RE.finditer(md):
+            first_pos.setdefault(m.group(), m.start())
+            if len(first_pos) == len(PATTERNS):
+                break
+        for kw, idx in first_pos.items():
+            start = max(0, idx - 80)
+            end = min(len(md), idx + 120)
+            print(f"\n  關鍵字「{kw}」出現在位置 {idx}：")
+            print(f"  ...{md[start:end]}...")
+        if not first_pos:
             print("  ⚠ 頁面中找不到任何學生相關關鍵字")
             print("--- markdown 前 800 字 ---")
             print(md[:800])
@@ -90,7 +88,7 @@ def main():
         print("✗ 找不到 data/course_list.json，請先執行 python scraper.py --discover")
         sys.exit(1)
 
-    course_list = json.loads(COURSE_LIST_FILE.read_text(encoding="utf-8"))
+    course_list = load_course_list()   # 有 orjson 時用 orjson 讀
     hahow_courses = course_list.get("hahow", [])[:n]
 
     if not hahow_courses: